@@ -0,0 +1,587 @@
+"""
+Offline end-to-end benchmark for the MyFitnessPal export pipeline.
+
+Starts local stand-ins for every external service main.py talks to:
+
+* an IMAP-over-TLS server seeded with N synthetic export emails,
+* an HTTP server serving synthetic export ZIPs (and expired-link 403s),
+* a bare git repository used as the dogsheep-data remote,
+
+then runs the real functions from main.py against them and reports wall
+time, bytes transferred and peak Python memory for each stage.
+
+The IMAP and HTTP stand-ins run in a separate process, so the peak memory
+figures cover only the pipeline itself. Git has no local byte counter, so
+the git stages report how much the on-disk repository grew instead; the
+table marks those figures with "~".
+
+Usage:
+    pipenv run python benchmark.py --sizes 10 100 1000 10000
+"""
+
+import argparse
+import contextlib
+import email.utils
+import io
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import socket
+import socketserver
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta, timezone
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.connection import Connection
+from typing import Callable, Dict, List, Optional, Tuple
+
+from git import Repo
+
+import main
+
+# Magic variables
+DEFAULT_SIZES: List[int] = [10, 100, 1000, 10000]
+DEFAULT_EXPIRED_EVERY: int = 10
+DEFAULT_ZIP_DAYS: int = 30
+HOST: str = "127.0.0.1"
+EXPIRED_BODY: bytes = (
+    b'<?xml version="1.0" encoding="UTF-8"?>\n'
+    b"<Error><Code>AccessDenied</Code><Message>Request has expired</Message></Error>"
+)
+
+
+class ByteCounter:
+    """Running total of bytes sent by a stand-in server, shared across processes."""
+
+    def __init__(self):
+        self._value = multiprocessing.Value("q", 0)
+
+    def add(self, n: int):
+        with self._value.get_lock():
+            self._value.value += n
+
+    @property
+    def total(self) -> int:
+        return self._value.value
+
+
+# --- Synthetic data ---------------------------------------------------------
+
+
+def build_export_zip(start: datetime, days: int) -> Tuple[str, bytes]:
+    """Build a synthetic MyFitnessPal export ZIP and return (filename, payload)."""
+    end = start + timedelta(days=days - 1)
+    date_range = f"{start:%Y-%m-%d}-to-{end:%Y-%m-%d}"
+
+    nutrition = io.StringIO()
+    nutrition.write("Date,Meal,Calories,Fat (g),Carbohydrates (g),Protein (g)\n")
+    exercise = io.StringIO()
+    exercise.write("Date,Exercise,Type,Exercise Calories,Exercise Minutes\n")
+    measurement = io.StringIO()
+    measurement.write("Date,Weight\n")
+    for day in range(days):
+        date = f"{start + timedelta(days=day):%Y-%m-%d}"
+        for meal in ("Breakfast", "Lunch", "Dinner", "Snacks"):
+            nutrition.write(f"{date},{meal},{400 + day % 50},12.5,48.0,22.0\n")
+        exercise.write(f"{date},Walking,Cardio,{150 + day % 30},30\n")
+        measurement.write(f"{date},{80 - day * 0.01:.2f}\n")
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr(f"Nutrition-Summary-{date_range}.csv", nutrition.getvalue())
+        zip_ref.writestr(f"Exercise-Summary-{date_range}.csv", exercise.getvalue())
+        zip_ref.writestr(
+            f"Measurement-Summary-{date_range}.csv", measurement.getvalue()
+        )
+    return f"File-Export-{date_range}.zip", buffer.getvalue()
+
+
+def build_export_email(index: int, download_url: str) -> bytes:
+    """Build a synthetic export email shaped like the real MyFitnessPal one."""
+    html = (
+        "<html><body>"
+        '<div class="mfp-default--body">'
+        "<p>Your export is ready.</p>"
+        f'<a href="{download_url}">Download Files</a>'
+        "</div>"
+        "</body></html>"
+    )
+    msg = MIMEMultipart("alternative")
+    msg["From"] = f"MyFitnessPal <{main.FROM_ADDRESS}>"
+    msg["To"] = "bench@example.com"
+    msg["Subject"] = main.SUBJECT
+    msg["Date"] = email.utils.format_datetime(
+        datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=index)
+    )
+    msg["Message-ID"] = f"<bench-{index}@myfitnesspal.example>"
+    msg.attach(MIMEText("Your export is ready: " + download_url, "plain"))
+    msg.attach(MIMEText(html, "html"))
+    return msg.as_bytes()
+
+
+def generate_certificate(directory: str) -> Tuple[str, str]:
+    """Generate a throwaway self-signed certificate for the IMAP stand-in."""
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-keyout",
+            key_path,
+            "-out",
+            cert_path,
+            "-days",
+            "1",
+            "-subj",
+            "/CN=localhost",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert_path, key_path
+
+
+# --- IMAP stand-in ----------------------------------------------------------
+
+
+class IMAPHandler(socketserver.StreamRequestHandler):
+    """Just enough IMAP4rev1 for imaplib's login/examine/search/fetch/logout."""
+
+    def send(self, data: bytes):
+        self.wfile.write(data)
+        self.server.counter.add(len(data))
+
+    def handle(self):
+        self.send(b"* OK [CAPABILITY IMAP4rev1] benchmark IMAP ready\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.decode().rstrip("\r\n").split(" ", 2)
+            if len(parts) < 2:
+                continue
+            tag, command = parts[0], parts[1].upper()
+            args = parts[2] if len(parts) > 2 else ""
+
+            # Build the whole response and write it once, so each command costs
+            # one TLS record rather than several small writes
+            self.send(b"".join(self.respond(tag, command, args)))
+            if command == "LOGOUT":
+                return
+
+    def respond(self, tag: str, command: str, args: str) -> List[bytes]:
+        """Return the untagged and tagged response lines for one command."""
+        if command == "CAPABILITY":
+            response = [b"* CAPABILITY IMAP4rev1\r\n"]
+        elif command in ("SELECT", "EXAMINE"):
+            return [
+                f"* {len(self.server.messages)} EXISTS\r\n".encode(),
+                b"* 0 RECENT\r\n",
+                f"{tag} OK [READ-ONLY] {command} completed\r\n".encode(),
+            ]
+        elif command == "SEARCH":
+            ids = " ".join(str(i) for i in self.search(args))
+            response = [f"* SEARCH {ids}\r\n".encode()]
+        elif command == "FETCH":
+            response = []
+            for message_num in args.split(" ", 1)[0].split(","):
+                message = self.server.messages[int(message_num) - 1]
+                response.append(
+                    f"* {message_num} FETCH (RFC822 {{{len(message)}}}\r\n".encode()
+                )
+                response.append(message + b")\r\n")
+        elif command == "LOGOUT":
+            response = [b"* BYE benchmark IMAP logging out\r\n"]
+        elif command in ("LOGIN", "NOOP", "CLOSE"):
+            response = []
+        else:
+            return [f"{tag} BAD unsupported command {command}\r\n".encode()]
+        response.append(f"{tag} OK {command} completed\r\n".encode())
+        return response
+
+    def search(self, criteria: str) -> List[int]:
+        """Match the FROM/SUBJECT criteria main.py sends against the seeded headers."""
+        wanted = {
+            key.upper(): value.lower()
+            for key, value in re.findall(r'(FROM|SUBJECT) "([^"]*)"', criteria, re.I)
+        }
+        matches = []
+        for message_num, header in enumerate(self.server.headers, start=1):
+            if all(value in header[key] for key, value in wanted.items()):
+                matches.append(message_num)
+        return matches
+
+
+class IMAPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self, messages: List[bytes], context: ssl.SSLContext, counter: ByteCounter
+    ):
+        super().__init__((HOST, 0), IMAPHandler)
+        self.messages = messages
+        self.headers = [
+            {
+                "FROM": message_obj.get("From", "").lower(),
+                "SUBJECT": message_obj.get("Subject", "").lower(),
+            }
+            for message_obj in map(email.message_from_bytes, messages)
+        ]
+        self.context = context
+        self.counter = counter
+
+    def get_request(self):
+        sock, address = super().get_request()
+        # Disable Nagle so replies are not held back waiting for delayed ACKs
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return self.context.wrap_socket(sock, server_side=True), address
+
+
+# --- HTTP stand-in ----------------------------------------------------------
+
+
+class ExportHTTPHandler(BaseHTTPRequestHandler):
+    """Serve the synthetic export ZIP, or an S3-style expired-link error."""
+
+    def do_GET(self):
+        if self.path.startswith("/expired/"):
+            self.respond(403, EXPIRED_BODY, {"Content-Type": "application/xml"})
+        elif self.path.startswith("/exports/"):
+            filename, payload = self.server.export_zip
+            self.respond(
+                200,
+                payload,
+                {
+                    "Content-Type": "application/zip",
+                    "Content-Disposition": f'attachment; filename="{filename}"',
+                },
+            )
+        else:
+            self.respond(404, b"Not Found", {"Content-Type": "text/plain"})
+
+    def respond(self, status: int, body: bytes, headers: Dict[str, str]):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.counter.add(len(body))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ExportHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, export_zip: Tuple[str, bytes], counter: ByteCounter):
+        super().__init__((HOST, 0), ExportHTTPHandler)
+        self.export_zip = export_zip
+        self.counter = counter
+
+
+# --- Stand-in process -------------------------------------------------------
+
+
+def serve_stand_ins(
+    mailbox_size: int,
+    expired_every: int,
+    zip_days: int,
+    cert_path: str,
+    key_path: str,
+    imap_counter: ByteCounter,
+    http_counter: ByteCounter,
+    ports: Connection,
+):
+    """Seed and run the IMAP and HTTP stand-ins until the process is terminated."""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+
+    http_server = ExportHTTPServer(
+        build_export_zip(datetime(2024, 1, 1), zip_days), http_counter
+    )
+    base_url = f"http://{HOST}:{http_server.server_address[1]}"
+    messages = []
+    for index in range(mailbox_size):
+        expired = expired_every and (index + 1) % expired_every == 0
+        path = "expired" if expired else "exports"
+        messages.append(build_export_email(index, f"{base_url}/{path}/{index}"))
+    imap_server = IMAPServer(messages, context, imap_counter)
+
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    ports.send((imap_server.server_address[1], http_server.server_address[1]))
+    ports.close()
+    imap_server.serve_forever()
+
+
+def start_stand_ins(
+    mailbox_size: int, expired_every: int, zip_days: int, work_dir: str
+) -> Tuple[multiprocessing.Process, int, ByteCounter, ByteCounter]:
+    """Start the stand-in process; return it, the IMAP port and both byte counters."""
+    cert_path, key_path = generate_certificate(work_dir)
+    imap_counter = ByteCounter()
+    http_counter = ByteCounter()
+    receive_ports, send_ports = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(
+        target=serve_stand_ins,
+        args=(
+            mailbox_size,
+            expired_every,
+            zip_days,
+            cert_path,
+            key_path,
+            imap_counter,
+            http_counter,
+            send_ports,
+        ),
+        daemon=True,
+    )
+    process.start()
+    send_ports.close()
+    try:
+        imap_port, _ = receive_ports.recv()
+    except EOFError:
+        process.join()
+        raise RuntimeError(
+            f"Stand-in servers failed to start (exit code {process.exitcode})"
+        )
+    finally:
+        receive_ports.close()
+    return process, imap_port, imap_counter, http_counter
+
+
+# --- Git stand-in -----------------------------------------------------------
+
+
+def create_bare_remote(directory: str) -> str:
+    """Create a bare dogsheep-data remote with a single commit on main."""
+    remote_dir = os.path.join(directory, "dogsheep-data.git")
+    Repo.init(remote_dir, bare=True, initial_branch="main")
+
+    seed_dir = os.path.join(directory, "seed")
+    seed = Repo.init(seed_dir, initial_branch="main")
+    readme_path = os.path.join(seed_dir, "README.md")
+    with open(readme_path, "w") as readme:
+        readme.write("# dogsheep-data\n")
+    seed.index.add(["README.md"])
+    seed.index.commit("Initial commit")
+    seed.create_remote("origin", remote_dir).push("main:main")
+    shutil.rmtree(seed_dir)
+    return remote_dir
+
+
+def directory_size(path: str) -> int:
+    """Return the total size in bytes of all files under path."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+# --- Measurement ------------------------------------------------------------
+
+
+@dataclass
+class StageResult:
+    mailbox_size: int
+    stage: str
+    wall_seconds: float
+    bytes_transferred: int
+    bytes_approximate: bool
+    peak_memory_bytes: int
+
+
+def measure(
+    mailbox_size: int,
+    stage: str,
+    func: Callable,
+    bytes_transferred: Callable[[], int],
+    bytes_approximate: bool = False,
+):
+    """Run func once and return (its result, StageResult)."""
+    bytes_before = bytes_transferred()
+    tracemalloc.reset_peak()
+    memory_before, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    result = func()
+    wall_seconds = time.perf_counter() - start
+    _, memory_peak = tracemalloc.get_traced_memory()
+    return result, StageResult(
+        mailbox_size=mailbox_size,
+        stage=stage,
+        wall_seconds=wall_seconds,
+        bytes_transferred=bytes_transferred() - bytes_before,
+        bytes_approximate=bytes_approximate,
+        peak_memory_bytes=max(memory_peak - memory_before, 0),
+    )
+
+
+def run_benchmark(
+    mailbox_size: int, expired_every: int, zip_days: int
+) -> List[StageResult]:
+    """Run every pipeline stage once against a freshly seeded set of stand-ins."""
+    original_cwd = os.getcwd()
+    original_imap_port = main.IMAP_PORT
+    original_repo_url = main.DOGSHEEP_REPO_URL
+    work_dir = tempfile.mkdtemp(prefix="mfp-bench-")
+    stand_ins = None
+
+    try:
+        stand_ins, imap_port, imap_counter, http_counter = start_stand_ins(
+            mailbox_size, expired_every, zip_days, work_dir
+        )
+        remote_dir = create_bare_remote(work_dir)
+
+        # Point main.py at the stand-ins
+        main.IMAP_PORT = imap_port
+        main.DOGSHEEP_REPO_URL = remote_dir
+        os.environ.update(
+            {"EMAIL_USER": "bench", "EMAIL_PASSWORD": "bench", "IMAP_URL": HOST}
+        )
+        os.chdir(work_dir)
+
+        results = []
+        repo_dir, result = measure(
+            mailbox_size,
+            "clone_dogsheep_data",
+            lambda: main.clone_dogsheep_data("main"),
+            lambda: directory_size(os.path.join(work_dir, "dogsheep-data", ".git")),
+            bytes_approximate=True,
+        )
+        results.append(result)
+
+        mail, result = measure(
+            mailbox_size,
+            "connect_to_email",
+            main.connect_to_email,
+            lambda: imap_counter.total,
+        )
+        results.append(result)
+
+        try:
+            emails, result = measure(
+                mailbox_size,
+                "search_and_fetch_emails",
+                lambda: main.search_and_fetch_emails(
+                    mail, main.FROM_ADDRESS, main.SUBJECT
+                ),
+                lambda: imap_counter.total,
+            )
+            results.append(result)
+        finally:
+            mail.logout()
+
+        _, result = measure(
+            mailbox_size,
+            "process_emails",
+            lambda: main.process_emails(emails),
+            lambda: http_counter.total,
+        )
+        results.append(result)
+
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            _, result = measure(
+                mailbox_size,
+                "commit_and_push",
+                lambda: main.commit_untracked_files_to_repo(repo_dir, "benchmark.py"),
+                lambda: directory_size(remote_dir),
+                bytes_approximate=True,
+            )
+        results.append(result)
+        return results
+    finally:
+        if stand_ins is not None:
+            stand_ins.terminate()
+            stand_ins.join()
+        os.chdir(original_cwd)
+        main.IMAP_PORT = original_imap_port
+        main.DOGSHEEP_REPO_URL = original_repo_url
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def format_bytes(n: int) -> str:
+    """Format a byte count for the results table."""
+    for unit in ("B", "KiB", "MiB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GiB"
+
+
+def print_results(results: List[StageResult]):
+    """Print the results as a fixed-width table."""
+    print(
+        f"{'messages':>8}  {'stage':<24}{'wall (s)':>10}{'bytes':>14}{'peak mem':>14}"
+    )
+    for result in results:
+        print(
+            f"{result.mailbox_size:>8}  {result.stage:<24}"
+            f"{result.wall_seconds:>10.3f}"
+            f"{('~' if result.bytes_approximate else '') + format_bytes(result.bytes_transferred):>14}"
+            f"{format_bytes(result.peak_memory_bytes):>14}"
+        )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="Mailbox sizes (number of seeded export emails) to benchmark",
+    )
+    parser.add_argument(
+        "--expired-every",
+        type=int,
+        default=DEFAULT_EXPIRED_EVERY,
+        help="Make every Nth download link return an expired-link 403 (0 to disable)",
+    )
+    parser.add_argument(
+        "--zip-days",
+        type=int,
+        default=DEFAULT_ZIP_DAYS,
+        help="Number of days of data in each synthetic export ZIP",
+    )
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def benchmark_main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    tracemalloc.start()
+
+    results: List[StageResult] = []
+    for mailbox_size in args.sizes:
+        print(f"Benchmarking mailbox with {mailbox_size} messages...", file=sys.stderr)
+        results.extend(run_benchmark(mailbox_size, args.expired_every, args.zip_days))
+
+    tracemalloc.stop()
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump([asdict(result) for result in results], json_file, indent=4)
+
+
+if __name__ == "__main__":
+    benchmark_main()
@@ -1,3 +1,17 @@
+import argparse
+import asyncio
+import bz2
+import contextlib
+import multiprocessing
+import re
+import sqlite3
+import sys
+import time
+import xml.etree.ElementTree as ET
+import zlib
+from collections import defaultdict, namedtuple
+from functools import partial
+
 import requests
 
 # File containing the list of pages
@@ -9,36 +23,628 @@ api_url = "https://en.wikipedia.org/w/api.php"
 # Text to search for
 search_text = "pqasb.pqarchiver.com/"
 
-# Function to fetch page content
-def fetch_page_content(page_title):
-    params = {
+# Characters of wikitext shown on each side of a match
+context_chars = 40
+
+# Maximum number of titles per API request (500 for accounts with apihighlimits)
+batch_size = 50
+
+# Identify the script to the API, as required by the Wikimedia User-Agent policy
+user_agent = "search-wikipedia-pages (https://github.com/RamVasuthevan/scripts)"
+
+# SQLite file caching page content by page ID and revision ID
+cache_file = 'pages_cache.sqlite'
+
+# Async mode: maximum in-flight requests and requests per second
+concurrency = 4
+requests_per_second = 10
+
+# Async mode: seconds of replication lag at which the API asks us to back off
+maxlag = 5
+
+# Async mode: retries and base backoff (seconds) for maxlag and 429 responses
+max_retries = 5
+backoff = 1
+
+# Dump mode: bytes read from the dump at a time while decompressing one stream
+dump_read_size = 1024 * 1024
+
+# A single pattern match within a page's wikitext
+PatternMatch = namedtuple("PatternMatch", ["pattern", "start", "end", "context"])
+
+# Regex features that change meaning or clash once patterns share one alternation:
+# backreferences, named groups and conditionals
+separate_regex_features = re.compile(r"\\[1-9]|\(\?P[<=]|\(\?\(")
+
+# Global inline flags at the start of a regex, such as (?i)
+global_flags = re.compile(r"\(\?([aiLmsu]+)\)")
+
+# Set of literal and regex patterns, each of which is reported wherever it matches
+class PatternSet:
+    def __init__(self, patterns):
+        # patterns is a list of (pattern, is_regex) pairs
+        self.patterns = []
+        # Patterns checked at each offset found by the combined prefilter
+        self.matchers = []
+        # Regexes that cannot join the prefilter and get a pass of their own
+        self.separate = []
+        alternatives = []
+        for index, (pattern, is_regex) in enumerate(patterns):
+            if is_regex:
+                validate_regex(pattern)
+            elif not pattern:
+                raise ValueError("Empty pattern would match at every offset")
+            self.patterns.append(pattern)
+            regex = re.compile(pattern if is_regex else re.escape(pattern))
+
+            alternative = combinable_alternative(pattern) if is_regex else re.escape(pattern)
+            if alternative is None:
+                self.separate.append((index, regex))
+            else:
+                alternatives.append(alternative)
+                self.matchers.append((index, regex))
+
+        # One pass over the page finds every offset where some pattern starts; the
+        # lookahead is zero-width so patterns that overlap each other are all found
+        self.prefilter = None
+        if alternatives:
+            self.prefilter = re.compile(f"(?=(?:{'|'.join(alternatives)}))")
+
+    @classmethod
+    def from_file(cls, path):
+        # One pattern per line; "re:" marks a regex, blank lines and "#" comments are skipped
+        patterns = []
+        with open(path, 'r') as file:
+            for line_number, line in enumerate(file, start=1):
+                line = line.rstrip("\n")
+                if not line.strip() or line.lstrip().startswith("#"):
+                    continue
+                if line.startswith("re:"):
+                    pattern = line[len("re:"):]
+                    try:
+                        validate_regex(pattern)
+                    except ValueError as error:
+                        raise ValueError(f"{path}:{line_number}: {error}")
+                    patterns.append((pattern, True))
+                else:
+                    patterns.append((line, False))
+        return cls(patterns)
+
+    def search(self, content, context_chars=context_chars):
+        spans = []
+        if self.prefilter:
+            # Like finditer, a pattern is not matched again inside its own previous match
+            next_start = {}
+            for candidate in self.prefilter.finditer(content):
+                start = candidate.start()
+                for index, regex in self.matchers:
+                    if start < next_start.get(index, 0):
+                        continue
+                    match = regex.match(content, start)
+                    if match and match.end() > start:
+                        spans.append((start, index, match.end()))
+                        next_start[index] = match.end()
+        for index, regex in self.separate:
+            for match in regex.finditer(content):
+                if match.end() > match.start():
+                    spans.append((match.start(), index, match.end()))
+
+        matches = []
+        for start, index, end in sorted(spans):
+            context = content[max(0, start - context_chars):end + context_chars]
+            matches.append(PatternMatch(self.patterns[index], start, end,
+                                        context.replace("\n", " ")))
+        return matches
+
+# Function to reject regexes that are invalid or would match at every offset
+def validate_regex(pattern):
+    if not pattern:
+        raise ValueError("empty regex would match at every offset")
+    try:
+        regex = re.compile(pattern)
+    except re.error as error:
+        raise ValueError(f"invalid regex {pattern!r}: {error}")
+    if regex.match("") is not None:
+        raise ValueError(f"regex {pattern!r} matches the empty string, so it would match at every offset")
+
+# Function to rewrite a regex so it can join the combined alternation, or None if it cannot
+def combinable_alternative(pattern):
+    if separate_regex_features.search(pattern):
+        return None
+    flags = global_flags.match(pattern)
+    if flags:
+        # (?i)rest becomes (?i:rest), which only applies to this alternative
+        pattern = f"(?{flags.group(1)}:{pattern[flags.end():]})"
+    try:
+        re.compile(f"(?:{pattern})")
+    except re.error:
+        return None
+    return pattern
+
+# Function to create a pooled HTTP session for API requests
+def create_session():
+    session = requests.Session()
+    session.headers.update({"User-Agent": user_agent})
+    return session
+
+# Function to resolve a title through the API's normalized and redirects mappings
+def resolve_title(title, normalized, redirects):
+    title = normalized.get(title, title)
+    seen = set()
+    while title in redirects and title not in seen:
+        seen.add(title)
+        title = redirects[title]
+    return title
+
+# Function to build the query parameters for one batch of titles
+def batch_params(titles):
+    return {
         "action": "query",
         "prop": "revisions",
-        "titles": page_title,
+        "titles": "|".join(titles),
         "rvslots": "main",
         "rvprop": "content",
-        "format": "json"
+        "redirects": 1,
+        "format": "json",
+        "formatversion": 2
+    }
+
+# Function to get a page's latest revision content, or None if it is missing or hidden
+def revision_content(page):
+    if not page.get("revisions"):
+        return None
+    return page["revisions"][0].get("slots", {}).get("main", {}).get("content")
+
+# Function to collect normalized titles, redirects and page content from one API response
+def merge_query(data, normalized, redirects, contents):
+    query = data.get("query", {})
+    for item in query.get("normalized", []):
+        normalized[item["from"]] = item["to"]
+    for item in query.get("redirects", []):
+        redirects[item["from"]] = item["to"]
+    for page in query.get("pages", []):
+        content = revision_content(page)
+        if content is not None:
+            contents[page["title"]] = content
+
+# Function to map the collected content back to the requested titles
+def map_contents(titles, normalized, redirects, contents):
+    return {
+        title: contents.get(resolve_title(title, normalized, redirects), "")
+        for title in titles
+    }
+
+# Error returned by the API in place of a query result
+class APIError(Exception):
+    pass
+
+# Function to raise on an API error and print any API warnings, such as truncated results
+def check_response(data):
+    if "error" in data:
+        error = data["error"]
+        raise APIError(f"{error.get('code')}: {error.get('info')}")
+    for module, warning in data.get("warnings", {}).items():
+        print(f"API warning from {module}: {warning.get('warnings') or warning.get('*')}",
+              file=sys.stderr)
+
+# Function to yield every response of a query, following continuation until it is complete
+def query_all(session, params, api_url=api_url):
+    continue_params = {}
+    while True:
+        response = session.get(api_url, params={**params, **continue_params})
+        response.raise_for_status()
+        data = response.json()
+        check_response(data)
+        yield data
+        if "continue" not in data:
+            break
+        continue_params = data["continue"]
+
+# Function to fetch the content of one batch of pages, keyed by the requested title
+def fetch_batch_content(session, titles, api_url=api_url):
+    params = batch_params(titles)
+    normalized = {}
+    redirects = {}
+    contents = {}
+
+    for data in query_all(session, params, api_url):
+        merge_query(data, normalized, redirects, contents)
+
+    return map_contents(titles, normalized, redirects, contents)
+
+# Function to split titles into unique, non-empty batches of batch_size
+def batches(page_titles, batch_size=batch_size):
+    unique_titles = list(dict.fromkeys(title for title in page_titles if title))
+    for start in range(0, len(unique_titles), batch_size):
+        yield unique_titles[start:start + batch_size]
+
+# Function to fetch the content of many pages, batch_size titles per request
+def fetch_pages_content(page_titles, session=None, api_url=api_url, batch_size=batch_size):
+    session = session or create_session()
+    for batch in batches(page_titles, batch_size):
+        yield from fetch_batch_content(session, batch, api_url).items()
+
+# Function to open the page cache, creating its table if needed
+def open_cache(path=cache_file):
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS pages (
+            page_id INTEGER PRIMARY KEY,
+            title TEXT NOT NULL,
+            rev_id INTEGER NOT NULL,
+            content BLOB NOT NULL
+        )
+    ''')
+    return conn
+
+# Function to fetch the page ID and latest revision ID of one batch of titles
+def fetch_batch_info(session, titles, api_url=api_url):
+    params = {
+        "action": "query",
+        "prop": "info",
+        "titles": "|".join(titles),
+        "redirects": 1,
+        "format": "json",
+        "formatversion": 2
+    }
+    normalized = {}
+    redirects = {}
+    info = {}
+    for data in query_all(session, params, api_url):
+        merge_query(data, normalized, redirects, {})
+        for page in data.get("query", {}).get("pages", []):
+            if "lastrevid" in page:
+                info[page["title"]] = (page["pageid"], page["lastrevid"])
+
+    # Missing pages have no page ID and are left out
+    return {
+        title: info[resolve_title(title, normalized, redirects)]
+        for title in titles
+        if resolve_title(title, normalized, redirects) in info
     }
-    response = requests.get(api_url, params=params)
-    data = response.json()
-    pages = data["query"]["pages"]
-    for page_id in pages:
-        if "revisions" in pages[page_id]:
-            return pages[page_id]["revisions"][0]["slots"]["main"]["*"]
-    return ""
-
-# Read the list of pages from the file
-with open(watchlist_file, 'r') as file:
-    pages = [line.strip() for line in file.readlines()]
-
-# Search for the text in each page
-matching_pages = []
-
-for page in pages:
-    content = fetch_page_content(page)
-    if search_text in content:
-        matching_pages.append(page)
-
-# Print matching pages
-for title in matching_pages:
+
+# Function to fetch the current revision ID and content of one batch of page IDs
+def fetch_batch_content_by_id(session, page_ids, api_url=api_url):
+    params = {
+        "action": "query",
+        "prop": "revisions",
+        "pageids": "|".join(str(page_id) for page_id in page_ids),
+        "rvslots": "main",
+        "rvprop": "ids|content",
+        "format": "json",
+        "formatversion": 2
+    }
+    pages = {}
+    for data in query_all(session, params, api_url):
+        for page in data.get("query", {}).get("pages", []):
+            content = revision_content(page)
+            if content is not None:
+                pages[page["pageid"]] = (page["title"], page["revisions"][0]["revid"], content)
+    return pages
+
+# Function to fetch the content of many pages, downloading only pages whose revision changed
+def fetch_pages_content_cached(page_titles, conn, session=None, api_url=api_url,
+                               batch_size=batch_size):
+    session = session or create_session()
+    for batch in batches(page_titles, batch_size):
+        info = fetch_batch_info(session, batch, api_url)
+        page_ids = list(dict.fromkeys(page_id for page_id, _ in info.values()))
+
+        cached_rev_ids = dict(conn.execute(
+            f"SELECT page_id, rev_id FROM pages WHERE page_id IN ({','.join('?' * len(page_ids))})",
+            page_ids
+        ).fetchall())
+        stale_ids = [page_id for page_id, rev_id in info.values()
+                     if cached_rev_ids.get(page_id) != rev_id]
+
+        if stale_ids:
+            fetched = fetch_batch_content_by_id(session, list(dict.fromkeys(stale_ids)), api_url)
+            conn.executemany(
+                "INSERT OR REPLACE INTO pages (page_id, title, rev_id, content) VALUES (?, ?, ?, ?)",
+                [(page_id, title, rev_id, zlib.compress(content.encode()))
+                 for page_id, (title, rev_id, content) in fetched.items()]
+            )
+            conn.commit()
+
+        contents = {
+            page_id: zlib.decompress(content).decode()
+            for page_id, content in conn.execute(
+                f"SELECT page_id, content FROM pages WHERE page_id IN ({','.join('?' * len(page_ids))})",
+                page_ids
+            )
+        }
+        for title in batch:
+            page_id = info.get(title, (None, None))[0]
+            yield title, contents.get(page_id, "")
+
+# Token bucket limiting how often requests may start
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        # At least one token, so rates below one request per second still make progress
+        self.capacity = max(1, capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# Function to make one rate-limited API request, retrying on maxlag, 429 and 503 responses
+async def request_json_async(session, params, bucket, api_url=api_url):
+    for attempt in range(max_retries + 1):
+        await bucket.acquire()
+        async with session.get(api_url, params={**params, "maxlag": maxlag}) as response:
+            retry_after = response.headers.get("Retry-After")
+            if response.status in (429, 503):
+                lagged = True
+            else:
+                response.raise_for_status()
+                data = await response.json(content_type=None)
+                lagged = data.get("error", {}).get("code") == "maxlag"
+            if not lagged:
+                check_response(data)
+                return data
+        if attempt == max_retries:
+            break
+        delay = backoff * 2 ** attempt
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, int(retry_after))
+        await asyncio.sleep(delay)
+    raise RuntimeError(f"API still lagged or rate limited after {max_retries} retries")
+
+# Function to fetch the content of one batch of pages asynchronously, keyed by the requested title
+async def fetch_batch_content_async(session, titles, bucket, api_url=api_url):
+    params = batch_params(titles)
+    normalized = {}
+    redirects = {}
+    contents = {}
+
+    # Follow continuation until the API has returned content for every page
+    continue_params = {}
+    while True:
+        data = await request_json_async(session, {**params, **continue_params}, bucket, api_url)
+        merge_query(data, normalized, redirects, contents)
+        if "continue" not in data:
+            break
+        continue_params = data["continue"]
+
+    return map_contents(titles, normalized, redirects, contents)
+
+# Function to scan pages concurrently, yielding (title, matches) as soon as they are found
+async def scan_pages_async(page_titles, pattern_set, api_url=api_url,
+                           batch_size=batch_size, concurrency=concurrency,
+                           requests_per_second=requests_per_second):
+    # Imported here so the synchronous modes do not need aiohttp installed
+    import aiohttp
+
+    bucket = TokenBucket(requests_per_second)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession(headers={"User-Agent": user_agent}) as session:
+        async def scan_batch(batch):
+            async with semaphore:
+                contents = await fetch_batch_content_async(session, batch, bucket, api_url)
+            results = [(title, pattern_set.search(content)) for title, content in contents.items()]
+            return [(title, matches) for title, matches in results if matches]
+
+        tasks = [asyncio.create_task(scan_batch(batch)) for batch in batches(page_titles, batch_size)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                for result in await task:
+                    yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+# Function to normalize a title the way the dump and its index spell it
+def normalize_title(title):
+    title = title.replace("_", " ").strip()
+    return title[:1].upper() + title[1:]
+
+# Function to read the multistream index, returning the stream offset of each wanted title
+# (or, with no titles, the offsets of every stream)
+def read_dump_index(index_path, titles=None):
+    offsets = {}
+    with bz2.open(index_path, 'rt', encoding='utf-8') as file:
+        for line in file:
+            offset, _, title = line.rstrip("\n").split(":", 2)
+            if titles is None:
+                offsets[int(offset)] = None
+            elif title in titles:
+                offsets[title] = int(offset)
+    return offsets
+
+# Function to decompress the single bz2 stream starting at offset in the dump
+def read_dump_stream(dump_path, offset):
+    decompressor = bz2.BZ2Decompressor()
+    chunks = []
+    with open(dump_path, 'rb') as file:
+        file.seek(offset)
+        while not decompressor.eof:
+            block = file.read(dump_read_size)
+            if not block:
+                break
+            chunks.append(decompressor.decompress(block))
+    return b"".join(chunks).decode('utf-8')
+
+# Function to scan the pages of one dump stream; titles limits the scan to those pages
+def scan_dump_stream(dump_path, pattern_set, task):
+    offset, titles = task
+    xml_text = read_dump_stream(dump_path, offset).replace("</mediawiki>", "")
+    results = []
+    for page in ET.fromstring(f"<pages>{xml_text}</pages>").iter("page"):
+        title = page.findtext("title")
+        if titles is not None and title not in titles:
+            continue
+        redirect = page.find("redirect")
+        redirect_title = redirect.get("title") if redirect is not None else None
+        matches = pattern_set.search(page.findtext("revision/text") or "")
+        if matches or titles is not None:
+            results.append((title, redirect_title, matches))
+    return results
+
+# Function to scan a multistream dump, yielding (title, matches) for every matching page.
+# With page_titles only those pages (and their redirect targets) are read, via the index.
+def scan_dump(dump_path, index_path, pattern_set, page_titles=None, processes=None):
+    with multiprocessing.Pool(processes) as pool:
+        scan = partial(scan_dump_stream, dump_path, pattern_set)
+
+        if page_titles is None:
+            tasks = [(offset, None) for offset in read_dump_index(index_path)]
+            for results in pool.imap_unordered(scan, tasks):
+                for title, _, matches in results:
+                    yield title, matches
+            return
+
+        # Map each normalized title back to the watchlist titles that spell it
+        original_titles = defaultdict(list)
+        for title in page_titles:
+            if title:
+                original_titles[normalize_title(title)].append(title)
+
+        redirects = {}
+        found = {}
+        looked_up = set()
+        wanted = set(original_titles)
+        while wanted:
+            looked_up |= wanted
+            titles_by_offset = defaultdict(set)
+            for title, offset in read_dump_index(index_path, wanted).items():
+                titles_by_offset[offset].add(title)
+            for results in pool.imap_unordered(scan, titles_by_offset.items()):
+                for title, redirect_title, matches in results:
+                    found[title] = matches
+                    if redirect_title:
+                        redirects[title] = redirect_title
+                    elif matches:
+                        for original_title in original_titles.get(title, []):
+                            yield original_title, matches
+            # Follow redirects to pages not looked up yet; targets missing from the dump
+            # (broken redirects, excluded namespaces) are looked up once and then dropped
+            wanted = set(redirects.values()) - looked_up
+
+        for title in original_titles:
+            if title in redirects:
+                matches = found.get(resolve_title(title, {}, redirects))
+                if matches:
+                    for original_title in original_titles[title]:
+                        yield original_title, matches
+
+# Function to read the list of pages from the file
+def read_watchlist(path):
+    with open(path, 'r') as file:
+        return [line.strip() for line in file if line.strip()]
+
+# Function to search (title, content) pairs, returning (title, matches) for each matching page
+def search_pages(pages_content, pattern_set):
+    matching_pages = []
+    for page, content in pages_content:
+        matches = pattern_set.search(content)
+        if matches:
+            matching_pages.append((page, matches))
+    return matching_pages
+
+# Function to print a matching page and where each pattern matched
+def print_matches(title, matches):
     print(f'Matching page: {title}')
+    for match in matches:
+        print(f'    {match.pattern!r} at {match.start}: ...{match.context}...')
+
+# Function to print matching pages as they are streamed from the async scan
+async def print_matches_async(pages, pattern_set, args):
+    async for title, matches in scan_pages_async(pages, pattern_set,
+                                                 concurrency=args.concurrency,
+                                                 requests_per_second=args.rate):
+        print_matches(title, matches)
+        sys.stdout.flush()
+
+# Function to parse a command-line value that must be greater than zero
+def positive_float(value):
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0: {value}")
+    return number
+
+# Function to parse a command-line count that must be at least one
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1: {value}")
+    return number
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search Wikipedia pages for search_text or a file of patterns")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Scan batches concurrently and print matches as they are found")
+    parser.add_argument("--concurrency", type=positive_int, default=concurrency,
+                        help="Maximum number of in-flight requests in async mode")
+    parser.add_argument("--rate", type=positive_float, default=requests_per_second,
+                        help="Maximum requests per second in async mode")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false",
+                        help=f"Download every page instead of using {cache_file}")
+    parser.add_argument("--patterns",
+                        help="File of patterns to search for instead of search_text, one per line "
+                             "(prefix regexes with re:)")
+    parser.add_argument("--dump",
+                        help="Scan a local pages-articles-multistream.xml.bz2 dump instead of the API")
+    parser.add_argument("--index",
+                        help="Multistream index for --dump (default: alongside the dump)")
+    parser.add_argument("--all", dest="scan_all", action="store_true",
+                        help="With --dump, scan every page instead of the watchlist")
+    parser.add_argument("--processes", type=positive_int,
+                        help="Processes decompressing the dump in parallel (default: all cores)")
+    args = parser.parse_args()
+
+    # Reject options that do not apply to the chosen mode instead of ignoring them
+    if args.dump:
+        for option, given in (("--async", args.use_async), ("--no-cache", not args.use_cache)):
+            if given:
+                parser.error(f"{option} does not apply with --dump")
+    else:
+        for option, given in (("--all", args.scan_all), ("--index", args.index is not None),
+                              ("--processes", args.processes is not None)):
+            if given:
+                parser.error(f"{option} requires --dump")
+        if args.use_async and not args.use_cache:
+            parser.error("--no-cache does not apply with --async, which never uses the cache")
+
+    if args.patterns:
+        try:
+            pattern_set = PatternSet.from_file(args.patterns)
+        except ValueError as error:
+            parser.error(str(error))
+    else:
+        pattern_set = PatternSet([(search_text, False)])
+
+    if args.dump:
+        index_path = args.index or args.dump.replace(".xml.bz2", "-index.txt.bz2")
+        pages = None if args.scan_all else read_watchlist(watchlist_file)
+        for title, matches in scan_dump(args.dump, index_path, pattern_set, pages, args.processes):
+            print_matches(title, matches)
+            sys.stdout.flush()
+    elif args.use_async:
+        pages = read_watchlist(watchlist_file)
+        asyncio.run(print_matches_async(pages, pattern_set, args))
+    else:
+        pages = read_watchlist(watchlist_file)
+
+        # Search for the text in each page
+        if args.use_cache:
+            with contextlib.closing(open_cache()) as conn:
+                matching_pages = search_pages(fetch_pages_content_cached(pages, conn), pattern_set)
+        else:
+            matching_pages = search_pages(fetch_pages_content(pages), pattern_set)
+
+        # Print matching pages
+        for title, matches in matching_pages:
+            print_matches(title, matches)
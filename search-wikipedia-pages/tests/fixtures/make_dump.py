@@ -0,0 +1,66 @@
+import bz2
+import os
+from xml.sax.saxutils import escape, quoteattr
+
+# Regenerates the fixture dump and index: python tests/fixtures/make_dump.py
+fixtures_dir = os.path.dirname(os.path.abspath(__file__))
+dump_file = os.path.join(fixtures_dir, 'test-pages-articles-multistream.xml.bz2')
+index_file = os.path.join(fixtures_dir, 'test-pages-articles-multistream-index.txt.bz2')
+
+# Pages per bz2 stream as (title, redirect target, wikitext)
+streams = [
+    [
+        ("Alpha", None, "Archived at http://pqasb.pqarchiver.com/alpha/ in 2001."),
+        ("Beta", None, "Nothing to see here."),
+        ("Gamma", "Delta", "#REDIRECT [[Delta]]"),
+    ],
+    [
+        ("Delta", None, "Cited: pqasb.pqarchiver.com/delta & geocities.com/delta"),
+        ("Epsilon", None, "Old link http://pqasb.pqarchiver.com/epsilon/"),
+        ("Broken", "Missing", "#REDIRECT [[Missing]]"),
+    ],
+    [
+        ("Loop one", "Loop two", "#REDIRECT [[Loop two]]"),
+        ("Loop two", "Loop one", "#REDIRECT [[Loop one]]"),
+    ],
+]
+
+header = (
+    '<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.11/" version="0.11" xml:lang="en">\n'
+    '  <siteinfo>\n    <sitename>Fixture</sitename>\n  </siteinfo>\n'
+)
+
+# Function to render one page the way pages-articles dumps do
+def page_xml(page_id, title, redirect, text):
+    redirect_xml = f'    <redirect title={quoteattr(redirect)} />\n' if redirect else ""
+    return (
+        '  <page>\n'
+        f'    <title>{escape(title)}</title>\n'
+        '    <ns>0</ns>\n'
+        f'    <id>{page_id}</id>\n'
+        f'{redirect_xml}'
+        '    <revision>\n'
+        f'      <id>{page_id * 100}</id>\n'
+        f'      <text bytes="{len(text.encode())}" xml:space="preserve">{escape(text)}</text>\n'
+        '    </revision>\n'
+        '  </page>\n'
+    )
+
+if __name__ == "__main__":
+    data = bz2.compress(header.encode('utf-8'))
+    index = []
+    page_id = 0
+    for stream in streams:
+        offset = len(data)
+        xml = ""
+        for title, redirect, text in stream:
+            page_id += 1
+            xml += page_xml(page_id, title, redirect, text)
+            index.append(f"{offset}:{page_id}:{title}\n")
+        data += bz2.compress(xml.encode('utf-8'))
+    data += bz2.compress(b"</mediawiki>\n")
+
+    with open(dump_file, 'wb') as file:
+        file.write(data)
+    with open(index_file, 'wb') as file:
+        file.write(bz2.compress("".join(index).encode('utf-8')))
@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+dump_file = os.path.join(fixtures_dir, 'test-pages-articles-multistream.xml.bz2')
+index_file = os.path.join(fixtures_dir, 'test-pages-articles-multistream-index.txt.bz2')
+
+
+@pytest.fixture
+def pattern_set():
+    return main.PatternSet([(main.search_text, False)])
+
+
+def scan(pattern_set, page_titles=None):
+    results = main.scan_dump(dump_file, index_file, pattern_set, page_titles, processes=2)
+    return {title: [match.start for match in matches] for title, matches in results}
+
+
+def test_read_dump_index_finds_stream_offsets():
+    offsets = main.read_dump_index(index_file, {"Alpha", "Delta", "Not in dump"})
+    assert set(offsets) == {"Alpha", "Delta"}
+    assert offsets["Alpha"] != offsets["Delta"]
+    assert len(main.read_dump_index(index_file)) == 3
+
+
+def test_scan_all_pages(pattern_set):
+    assert set(scan(pattern_set)) == {"Alpha", "Delta", "Epsilon"}
+
+
+def test_scan_watchlist_maps_back_to_original_titles(pattern_set):
+    results = scan(pattern_set, ["alpha", "Beta", "Not in dump", ""])
+    assert results == {"alpha": [19]}
+
+
+def test_scan_watchlist_follows_redirects(pattern_set):
+    assert set(scan(pattern_set, ["Gamma", "Epsilon"])) == {"Gamma", "Epsilon"}
+
+
+def test_scan_watchlist_finishes_on_broken_and_looping_redirects(pattern_set):
+    assert scan(pattern_set, ["Broken", "Loop one"]) == {}
+
+
+def test_scan_uses_every_pattern(tmp_path):
+    patterns_file = tmp_path / "patterns.txt"
+    patterns_file.write_text("pqarchiver.com\nre:(?i)GEOCITIES\\.com\n")
+    pattern_set = main.PatternSet.from_file(str(patterns_file))
+
+    results = dict(main.scan_dump(dump_file, index_file, pattern_set, ["Delta"], processes=1))
+    assert [match.pattern for match in results["Delta"]] == ["pqarchiver.com", "(?i)GEOCITIES\\.com"]
@@ -0,0 +1,157 @@
+import contextlib
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+# Pages served by the mock API as title: (page ID, revision ID, wikitext)
+pages = {
+    "Alpha": (1, 100, "Archived at http://pqasb.pqarchiver.com/alpha/"),
+    "Beta": (2, 200, "Nothing to see here."),
+    "Delta": (4, 400, "Cited: pqasb.pqarchiver.com/delta"),
+    "Epsilon": (5, 500, "Also nothing."),
+}
+redirects = {"Gamma": "Delta"}
+
+# Pages with content returned per response, so larger batches need continuation
+revisions_per_response = 2
+
+
+class MockAPIHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        self.server.requests.append(params)
+        self.respond(self.query(params))
+
+    def query(self, params):
+        if "pageids" in params:
+            ids = [int(page_id) for page_id in params["pageids"].split("|")]
+            titles = [title for title, page in pages.items() if page[0] in ids]
+            query = {}
+        else:
+            titles = params["titles"].split("|")
+            if len(titles) > 50:
+                return {"error": {"code": "toomanyvalues", "info": "Too many values supplied"}}
+            query = {"normalized": [], "redirects": []}
+            resolved = []
+            for title in titles:
+                normalized_title = title.replace("_", " ")
+                normalized_title = normalized_title[:1].upper() + normalized_title[1:]
+                if normalized_title != title:
+                    query["normalized"].append({"from": title, "to": normalized_title})
+                if normalized_title in redirects:
+                    query["redirects"].append({"from": normalized_title,
+                                               "to": redirects[normalized_title]})
+                    normalized_title = redirects[normalized_title]
+                resolved.append(normalized_title)
+            titles = list(dict.fromkeys(resolved))
+
+        query["pages"] = []
+        for title in titles:
+            if title not in pages:
+                query["pages"].append({"title": title, "missing": True})
+                continue
+            page_id, rev_id, content = pages[title]
+            query["pages"].append({"pageid": page_id, "title": title, "lastrevid": rev_id})
+
+        data = {"query": query}
+        if params["prop"] == "revisions":
+            # Only hand out content from the rvcontinue offset onwards
+            start = int(params.get("rvcontinue", 0))
+            with_content = [page for page in query["pages"] if "pageid" in page]
+            for page in with_content[start:start + revisions_per_response]:
+                page_id, rev_id, content = pages[page["title"]]
+                page["revisions"] = [{"revid": rev_id, "slots": {"main": {"content": content}}}]
+            if start + revisions_per_response < len(with_content):
+                data["continue"] = {"rvcontinue": str(start + revisions_per_response),
+                                    "continue": "||"}
+        return data
+
+    def respond(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def mock_api():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockAPIHandler)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}/w/api.php"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def watchlist():
+    return ["alpha", "Beta", "Gamma", "Missing page", "Epsilon", "Delta"]
+
+
+expected_contents = {
+    "alpha": pages["Alpha"][2],
+    "Beta": pages["Beta"][2],
+    "Gamma": pages["Delta"][2],
+    "Missing page": "",
+    "Epsilon": pages["Epsilon"][2],
+    "Delta": pages["Delta"][2],
+}
+
+
+def test_fetch_pages_content_maps_back_to_original_titles(mock_api, watchlist):
+    server, url = mock_api
+    assert dict(main.fetch_pages_content(watchlist, api_url=url)) == expected_contents
+
+
+def test_fetch_pages_content_follows_continue(mock_api, watchlist):
+    server, url = mock_api
+    list(main.fetch_pages_content(watchlist, api_url=url))
+    # Four pages with content at two per response take two requests
+    assert [params.get("rvcontinue") for params in server.requests] == [None, "2"]
+
+
+def test_fetch_pages_content_batches_titles(mock_api, watchlist):
+    server, url = mock_api
+    assert dict(main.fetch_pages_content(watchlist, api_url=url, batch_size=2)) == expected_contents
+    assert all(len(params["titles"].split("|")) <= 2 for params in server.requests)
+
+
+def test_fetch_pages_content_raises_api_errors(mock_api):
+    server, url = mock_api
+    titles = [f"Page {number}" for number in range(60)]
+    with pytest.raises(main.APIError, match="toomanyvalues"):
+        list(main.fetch_pages_content(titles, api_url=url, batch_size=60))
+
+
+def test_fetch_pages_content_cached_downloads_only_changed_pages(mock_api, watchlist, monkeypatch):
+    server, url = mock_api
+    with contextlib.closing(main.open_cache(":memory:")) as conn:
+        assert dict(main.fetch_pages_content_cached(watchlist, conn, api_url=url)) == expected_contents
+        assert any(params["prop"] == "revisions" for params in server.requests)
+
+        # Nothing changed: only the prop=info pass is made
+        server.requests.clear()
+        assert dict(main.fetch_pages_content_cached(watchlist, conn, api_url=url)) == expected_contents
+        assert [params["prop"] for params in server.requests] == ["info"]
+
+        # A new revision of Delta is downloaded by page ID, the rest come from the cache
+        monkeypatch.setitem(pages, "Delta", (4, 401, "Dead link removed."))
+        server.requests.clear()
+        contents = dict(main.fetch_pages_content_cached(watchlist, conn, api_url=url))
+        assert contents["Gamma"] == contents["Delta"] == "Dead link removed."
+        assert contents["alpha"] == pages["Alpha"][2]
+        assert [params.get("pageids") for params in server.requests] == [None, "4"]
@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+def found(pattern_set, content):
+    return [(match.pattern, match.start, match.end) for match in pattern_set.search(content)]
+
+
+def test_overlapping_patterns_are_all_reported():
+    pattern_set = main.PatternSet([
+        ("pqarchiver.com", False),
+        ("pqasb.pqarchiver.com/", False),
+        (r"pqasb\.pqarchiver", True),
+        (r"https?://\S+", True),
+    ])
+    assert found(pattern_set, "see http://pqasb.pqarchiver.com/foo") == [
+        (r"https?://\S+", 4, 35),
+        ("pqasb.pqarchiver.com/", 11, 32),
+        (r"pqasb\.pqarchiver", 11, 27),
+        ("pqarchiver.com", 17, 31),
+    ]
+
+
+def test_regexes_share_one_prefilter_pass():
+    pattern_set = main.PatternSet([
+        ("geocities.com", False),
+        (r"(?i)WEBCITATION\.org", True),
+        (r"\bangelfire\.com/\w+", True),
+    ])
+    assert pattern_set.separate == []
+    assert len(pattern_set.matchers) == 3
+
+
+def test_global_inline_flags_apply_only_to_their_pattern():
+    pattern_set = main.PatternSet([(r"(?i)geocities\.com", True), ("GEOCITIES.NET", False)])
+    assert found(pattern_set, "GeoCities.com geocities.net GEOCITIES.NET") == [
+        (r"(?i)geocities\.com", 0, 13),
+        ("GEOCITIES.NET", 28, 41),
+    ]
+
+
+def test_backreferences_keep_their_meaning():
+    pattern_set = main.PatternSet([("x", False), (r"(['\"])dead\1", True)])
+    assert len(pattern_set.separate) == 1
+    assert found(pattern_set, "x 'dead' \"dead' ") == [("x", 0, 1), (r"(['\"])dead\1", 2, 8)]
+
+
+def test_pattern_is_not_matched_again_inside_its_own_match():
+    pattern_set = main.PatternSet([(r"a+", True)])
+    assert found(pattern_set, "aaa b aa") == [(r"a+", 0, 3), (r"a+", 6, 8)]
+
+
+def test_zero_length_matches_are_skipped():
+    pattern_set = main.PatternSet([(r"\b", True), (r"(?=x)", True), ("x", False)])
+    assert found(pattern_set, "a x") == [("x", 2, 3)]
+
+
+@pytest.mark.parametrize("line, message", [
+    ("re:", "empty regex"),
+    ("re:x*", "matches the empty string"),
+    ("re:(", "invalid regex"),
+])
+def test_from_file_rejects_bad_regexes(tmp_path, line, message):
+    patterns_file = tmp_path / "patterns.txt"
+    patterns_file.write_text(f"# comment\nliteral\n{line}\n")
+    with pytest.raises(ValueError, match=f"patterns.txt:3: .*{message}"):
+        main.PatternSet.from_file(str(patterns_file))